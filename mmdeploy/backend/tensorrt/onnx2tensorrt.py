@@ -85,4 +85,5 @@ def onnx2tensorrt(work_dir: str,
         int8_mode=final_params.get('int8_mode', False),
         int8_param=int8_param,
         max_workspace_size=final_params.get('max_workspace_size', 0),
-        device_id=device_id)
+        device_id=device_id,
+        timing_cache_file=final_params.get('timing_cache_file', None))
@@ -1,5 +1,8 @@
 # Copyright (c) OpenMMLab. All rights reserved.
+import functools
 import logging
+import os
+import os.path as osp
 from typing import Dict, Optional, Sequence, Union
 
 import onnx
@@ -21,6 +24,19 @@ def save(engine: trt.ICudaEngine, path: str) -> None:
         f.write(bytearray(engine.serialize()))
 
 
+@functools.lru_cache(maxsize=None)
+def get_runtime() -> trt.Runtime:
+    """Get the TensorRT runtime shared by all the loaded engines.
+
+    TensorRT requires the runtime to outlive the engines deserialized by it,
+    so a single runtime is created and kept for the whole process.
+
+    Returns:
+        tensorrt.Runtime: The shared TensorRT runtime.
+    """
+    return trt.Runtime(trt.Logger())
+
+
 def load(path: str) -> trt.ICudaEngine:
     """Deserialize TensorRT engine from disk.
 
@@ -31,11 +47,10 @@ def load(path: str) -> trt.ICudaEngine:
         tensorrt.ICudaEngine: The TensorRT engine loaded from disk.
     """
     load_tensorrt_plugin()
-    with trt.Logger() as logger, trt.Runtime(logger) as runtime:
-        with open(path, mode='rb') as f:
-            engine_bytes = f.read()
-        engine = runtime.deserialize_cuda_engine(engine_bytes)
-        return engine
+    with open(path, mode='rb') as f:
+        engine_bytes = f.read()
+    engine = get_runtime().deserialize_cuda_engine(engine_bytes)
+    return engine
 
 
 def from_onnx(onnx_model: Union[str, onnx.ModelProto],
@@ -47,6 +62,7 @@ def from_onnx(onnx_model: Union[str, onnx.ModelProto],
               int8_param: Optional[dict] = None,
               device_id: int = 0,
               log_level: trt.Logger.Severity = trt.Logger.ERROR,
+              timing_cache_file: Optional[str] = None,
               **kwargs) -> trt.ICudaEngine:
     """Create a tensorrt engine from ONNX.
 
@@ -65,6 +81,9 @@ def from_onnx(onnx_model: Union[str, onnx.ModelProto],
         device_id (int): Choice the device to create engine. Defaults to `0`.
         log_level (trt.Logger.Severity): The log level of TensorRT. Defaults to
             `trt.Logger.ERROR`.
+        timing_cache_file (str): The path of a tactic timing cache shared
+            between builds. It is loaded if it exists and updated after the
+            engine is built. Requires TensorRT>=8. Defaults to `None`.
 
     Returns:
         tensorrt.ICudaEngine: The TensorRT engine created from onnx_model.
@@ -83,7 +102,6 @@ def from_onnx(onnx_model: Union[str, onnx.ModelProto],
         >>>             })
     """
 
-    import os
     old_cuda_device = os.environ.get('CUDA_DEVICE', None)
     os.environ['CUDA_DEVICE'] = str(device_id)
     import pycuda.autoinit  # noqa:F401
@@ -147,11 +165,43 @@ def from_onnx(onnx_model: Union[str, onnx.ModelProto],
             builder.int8_mode = int8_mode
             builder.int8_calibrator = config.int8_calibrator
 
+    use_timing_cache = timing_cache_file is not None
+    if use_timing_cache and version.parse(
+            trt.__version__) < version.parse('8'):
+        get_root_logger().warning(
+            'Timing cache requires TensorRT>=8, but given: '
+            f'{trt.__version__}. `timing_cache_file` is ignored.')
+        use_timing_cache = False
+    if use_timing_cache:
+        cache_bytes = b''
+        if osp.exists(timing_cache_file):
+            with open(timing_cache_file, mode='rb') as f:
+                cache_bytes = f.read()
+        timing_cache = config.create_timing_cache(cache_bytes)
+        if timing_cache is None or not config.set_timing_cache(
+                timing_cache, ignore_mismatch=False):
+            # the file may come from another TensorRT version or device, or
+            # be corrupted. Start from an empty cache that replaces it.
+            get_root_logger().warning(
+                f'Failed to load timing cache from {timing_cache_file}, '
+                'an empty timing cache is used instead.')
+            timing_cache = config.create_timing_cache(b'')
+            config.set_timing_cache(timing_cache, ignore_mismatch=False)
+
     # create engine
     engine = builder.build_engine(network, config)
 
     assert engine is not None, 'Failed to create TensorRT engine'
 
+    if use_timing_cache:
+        # write aside and rename so that concurrent builds sharing the cache
+        # never load a partially written file
+        os.makedirs(osp.dirname(osp.abspath(timing_cache_file)), exist_ok=True)
+        tmp_file = f'{timing_cache_file}.{os.getpid()}.tmp'
+        with open(tmp_file, mode='wb') as f:
+            f.write(bytearray(config.get_timing_cache().serialize()))
+        os.replace(tmp_file, timing_cache_file)
+
     save(engine, output_file_prefix + '.engine')
     return engine
 
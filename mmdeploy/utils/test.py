@@ -263,7 +263,9 @@ class SwitchBackendWrapper:
 
 def assert_allclose(expected: List[Union[torch.Tensor, np.ndarray]],
                     actual: List[Union[torch.Tensor, np.ndarray]],
-                    tolerate_small_mismatch: bool = False):
+                    tolerate_small_mismatch: bool = False,
+                    rtol: float = 1e-03,
+                    atol: float = 1e-05):
     """Determine whether all actual values are closed with the expected values.
 
     Args:
@@ -271,6 +273,8 @@ def assert_allclose(expected: List[Union[torch.Tensor, np.ndarray]],
         expected (list[torch.Tensor | np.ndarray): Expected value.
         tolerate_small_mismatch (bool): Whether tolerate small mismatch,
         Default is False.
+        rtol (float): Relative tolerance. Default is 1e-03.
+        atol (float): Absolute tolerance. Default is 1e-05.
     """
     if not (isinstance(expected, list) and isinstance(actual, list)):
         raise ValueError('Argument desired and actual should be a list')
@@ -284,7 +288,7 @@ def assert_allclose(expected: List[Union[torch.Tensor, np.ndarray]],
             actual[i] = torch.tensor(actual[i])
         try:
             torch.testing.assert_allclose(
-                actual[i], expected[i], rtol=1e-03, atol=1e-05)
+                actual[i], expected[i], rtol=rtol, atol=atol)
         except AssertionError as error:
             if tolerate_small_mismatch:
                 assert '(0.00%)' in str(error), str(error)
@@ -1,4 +1,5 @@
 # Copyright (c) OpenMMLab. All rights reserved.
+import os
 import os.path as osp
 import tempfile
 
@@ -87,3 +88,72 @@ def test_onnx2tensorrt():
     assert osp.exists(engine_file)
     engine = load(engine_file)
     assert engine is not None
+
+
+def record_warnings(monkeypatch):
+    from mmdeploy.utils import get_root_logger
+    warnings = []
+    monkeypatch.setattr(get_root_logger(), 'warning', warnings.append)
+    return warnings
+
+
+def get_timing_cache_deploy_cfg(timing_cache_file):
+    deploy_cfg = get_deploy_cfg()
+    deploy_cfg.backend_config.common_config.timing_cache_file = \
+        timing_cache_file
+    return deploy_cfg
+
+
+@backend_checker(Backend.TENSORRT)
+def test_onnx2tensorrt_timing_cache(monkeypatch):
+    import tensorrt as trt
+    from packaging import version
+
+    from mmdeploy.apis.tensorrt import onnx2tensorrt
+    if version.parse(trt.__version__) < version.parse('8'):
+        pytest.skip('Timing cache requires TensorRT>=8.')
+    generate_onnx_file(test_model)
+    warnings = record_warnings(monkeypatch)
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        timing_cache_file = osp.join(work_dir, 'timing.cache')
+        deploy_cfg = get_timing_cache_deploy_cfg(timing_cache_file)
+
+        onnx2tensorrt(work_dir, 'first.engine', 0, deploy_cfg, onnx_file)
+        assert osp.exists(osp.join(work_dir, 'first.engine'))
+        assert osp.exists(timing_cache_file)
+
+        # the second build loads the cache written by the first one
+        onnx2tensorrt(work_dir, 'second.engine', 0, deploy_cfg, onnx_file)
+        assert osp.exists(osp.join(work_dir, 'second.engine'))
+        assert osp.exists(timing_cache_file)
+        assert len(warnings) == 0, warnings
+        assert not [f for f in os.listdir(work_dir) if f.endswith('.tmp')]
+
+
+@backend_checker(Backend.TENSORRT)
+def test_onnx2tensorrt_corrupted_timing_cache(monkeypatch):
+    import tensorrt as trt
+    from packaging import version
+
+    from mmdeploy.apis.tensorrt import onnx2tensorrt
+    if version.parse(trt.__version__) < version.parse('8'):
+        pytest.skip('Timing cache requires TensorRT>=8.')
+    generate_onnx_file(test_model)
+    warnings = record_warnings(monkeypatch)
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        timing_cache_file = osp.join(work_dir, 'timing.cache')
+        with open(timing_cache_file, 'wb') as f:
+            f.write(b'garbage')
+        deploy_cfg = get_timing_cache_deploy_cfg(timing_cache_file)
+
+        onnx2tensorrt(work_dir, 'end2end.engine', 0, deploy_cfg, onnx_file)
+        assert osp.exists(osp.join(work_dir, 'end2end.engine'))
+        cache_warnings = [
+            msg for msg in warnings if 'Failed to load timing cache' in msg
+        ]
+        assert len(cache_warnings) == 1, warnings
+        # the refused file is replaced by the freshly built cache
+        with open(timing_cache_file, 'rb') as f:
+            assert f.read() != b'garbage'
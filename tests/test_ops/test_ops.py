@@ -1,4 +1,8 @@
 # Copyright (c) OpenMMLab. All rights reserved.
+import os
+import os.path as osp
+import tempfile
+
 import onnx
 import pytest
 import torch
@@ -16,6 +20,13 @@ TEST_TENSORRT = TestTensorRTExporter()
 TEST_NCNN = TestNCNNExporter()
 
 
+@pytest.fixture(autouse=True)
+def fix_random_seed():
+    # random module weights are exported into the onnx model, a fixed seed
+    # keeps the TensorRT engine cache key stable across test sessions
+    torch.manual_seed(0)
+
+
 @pytest.mark.parametrize('backend', [TEST_TENSORRT])
 @pytest.mark.parametrize('pool_h,pool_w,spatial_scale,sampling_ratio',
                          [(2, 2, 1.0, 2), (4, 4, 2.0, 4)])
@@ -303,7 +314,8 @@ def test_instance_norm(backend,
             input_names=['input'],
             dynamic_axes=dynamic_axes,
             output_names=['output'],
-            save_dir=save_dir)
+            save_dir=save_dir,
+            fp16_mode=fp16_mode)
 
 
 @pytest.mark.parametrize('backend', [TEST_TENSORRT])
@@ -931,3 +943,94 @@ def test_roi_align_rotated(backend,
             input_names=['input', 'rois'],
             output_names=['roi_feat'],
             save_dir=save_dir)
+
+
+@pytest.mark.parametrize('backend', [TEST_TENSORRT])
+def test_tensorrt_engine_cache(backend, monkeypatch, tmp_path):
+    backend.check_env()
+
+    from . import utils as test_utils
+    cache_dir = str(tmp_path / 'cache')
+    monkeypatch.setattr(test_utils, 'TRT_CACHE_DIR', cache_dir)
+    monkeypatch.setattr(test_utils, 'TRT_TIMING_CACHE',
+                        osp.join(cache_dir, 'timing.cache'))
+    monkeypatch.delenv(test_utils.TRT_CACHE_ENV, raising=False)
+
+    builds = []
+    onnx2tensorrt = test_utils.trt_apis.onnx2tensorrt
+
+    def counted_onnx2tensorrt(*args, **kwargs):
+        builds.append(args)
+        return onnx2tensorrt(*args, **kwargs)
+
+    monkeypatch.setattr(test_utils.trt_apis, 'onnx2tensorrt',
+                        counted_onnx2tensorrt)
+
+    def list_engines():
+        return [f for f in os.listdir(cache_dir) if f.endswith('.engine')]
+
+    wrapped_model = WrapFunction(lambda x: x * 2).eval()
+    input = torch.rand(1, 3, 8, 8)
+
+    def run():
+        backend.run_and_validate(
+            wrapped_model, [input],
+            'engine_cache',
+            input_names=['input'],
+            output_names=['output'])
+
+    # the second run reuses the engine built by the first one
+    run()
+    assert len(builds) == 1
+    assert len(list_engines()) == 1
+    run()
+    assert len(builds) == 1
+    assert len(list_engines()) == 1
+
+    # disabling the cache builds again, outside of the cache directory
+    tmp_root = str(tmp_path / 'tmp')
+    os.makedirs(tmp_root)
+    monkeypatch.setattr(tempfile, 'tempdir', tmp_root)
+    monkeypatch.setenv(test_utils.TRT_CACHE_ENV, '0')
+    run()
+    assert len(builds) == 2
+    assert len(list_engines()) == 1
+    assert not [
+        f for f in os.listdir(tmp_root) if osp.isdir(osp.join(tmp_root, f))
+    ]
+
+
+@pytest.mark.parametrize('backend', [TEST_TENSORRT])
+def test_tensorrt_engine_cache_key(backend):
+    backend.check_env()
+
+    node = make_node('Relu', ['input'], ['output'])
+    graph = make_graph(
+        [node], 'relu_graph',
+        [make_tensor_value_info('input', onnx.TensorProto.FLOAT, None)],
+        [make_tensor_value_info('output', onnx.TensorProto.FLOAT, None)])
+    onnx_model = make_model(graph)
+
+    def get_key(fp16_mode=False,
+                shape=(1, 3, 8, 8),
+                timing_cache_file='timing.cache'):
+        backend_config = dict(
+            type='tensorrt',
+            common_config=dict(
+                fp16_mode=fp16_mode,
+                max_workspace_size=1 << 28,
+                timing_cache_file=timing_cache_file),
+            model_inputs=[
+                dict(
+                    input_shapes=dict(
+                        input=dict(
+                            min_shape=shape, opt_shape=shape,
+                            max_shape=shape)))
+            ])
+        return backend.get_engine_cache_key(onnx_model, backend_config)
+
+    key = get_key()
+    assert key == get_key()
+    assert key == get_key(timing_cache_file='/other/timing.cache')
+    assert key != get_key(fp16_mode=True)
+    assert key != get_key(shape=(2, 3, 8, 8))
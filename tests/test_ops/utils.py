@@ -1,4 +1,6 @@
 # Copyright (c) OpenMMLab. All rights reserved.
+import functools
+import hashlib
 import os
 import subprocess
 import tempfile
@@ -7,11 +9,95 @@ import mmcv
 import onnx
 import pytest
 import torch
+from packaging import version
 
 import mmdeploy.apis.tensorrt as trt_apis
 from mmdeploy.utils import Backend
 from mmdeploy.utils.test import assert_allclose, check_backend
 
+# serialized engines shared by all test sessions, keyed by model, config,
+# plugin library and device. The cache is never pruned, delete the directory
+# to reclaim space or set MMDEPLOY_TRT_TEST_CACHE=0 to build every engine
+# from scratch.
+TRT_CACHE_DIR = os.path.abspath('.pytest_trt_cache')
+TRT_CACHE_ENV = 'MMDEPLOY_TRT_TEST_CACHE'
+# tactic timings reused by every engine build of the test session
+TRT_TIMING_CACHE = os.path.join(TRT_CACHE_DIR, 'timing.cache')
+
+
+@functools.lru_cache(maxsize=None)
+def _file_sha1(path, mtime_ns, size):
+    """Get the sha1 of a file, memoized by its modification time and size."""
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+def export_onnx(model,
+                input_list,
+                onnx_file_path,
+                input_names=None,
+                output_names=None,
+                do_constant_folding=True,
+                dynamic_axes=None):
+    """Trace the model and export it to onnx with the settings shared by all
+    the test exporters."""
+    torch.onnx.export(
+        model,
+        tuple(input_list),
+        onnx_file_path,
+        export_params=True,
+        keep_initializers_as_inputs=True,
+        input_names=input_names,
+        output_names=output_names,
+        do_constant_folding=do_constant_folding,
+        dynamic_axes=dynamic_axes,
+        opset_version=11)
+
+
+def upload_inputs(input_names, input_list):
+    """Copy the inputs to cuda with one pinned host-to-device copy for each
+    dtype and return the name and device tensor pairs.
+
+    Inputs already on cuda are passed through unchanged.
+    """
+    inputs = {
+        name: data
+        for name, data in zip(input_names, input_list) if data.is_cuda
+    }
+    host_inputs = [(name, data) for name, data in zip(input_names, input_list)
+                   if not data.is_cuda]
+    for dtype in set(data.dtype for _, data in host_inputs):
+        names, tensors = zip(*[(name, data) for name, data in host_inputs
+                               if data.dtype == dtype])
+        staging = torch.empty(
+            sum(data.numel() for data in tensors),
+            dtype=dtype,
+            pin_memory=True)
+        torch.cat([data.reshape(-1) for data in tensors], out=staging)
+        flatten = staging.cuda(non_blocking=True)
+        views = flatten.split([data.numel() for data in tensors])
+        for name, data, view in zip(names, tensors, views):
+            inputs[name] = view.view(data.shape)
+    return {name: inputs[name] for name in input_names}
+
+
+def all_close(expected, actual, rtol, atol):
+    """Check whether all the outputs are close with a single comparison of
+    the flattened and concatenated tensors."""
+    if len(expected) != len(actual) or len(expected) == 0:
+        return False
+    if any(e.shape != a.shape for e, a in zip(expected, actual)):
+        return False
+    return torch.allclose(
+        torch.cat([data.reshape(-1) for data in actual]),
+        torch.cat([data.reshape(-1) for data in expected]),
+        rtol=rtol,
+        atol=atol,
+        equal_nan=True)
+
 
 @pytest.mark.skip(reason='This a not test class but a utility class.')
 class TestOnnxRTExporter:
@@ -22,6 +108,7 @@ class TestOnnxRTExporter:
     def check_env(self):
         check_backend(Backend.ONNXRUNTIME, True)
 
+    @torch.no_grad()
     def run_and_validate(self,
                          model,
                          input_list,
@@ -39,21 +126,10 @@ class TestOnnxRTExporter:
         else:
             onnx_file_path = os.path.join(save_dir, model_name + '.onnx')
 
-        with torch.no_grad():
-            torch.onnx.export(
-                model,
-                tuple(input_list),
-                onnx_file_path,
-                export_params=True,
-                keep_initializers_as_inputs=True,
-                input_names=input_names,
-                output_names=output_names,
-                do_constant_folding=do_constant_folding,
-                dynamic_axes=dynamic_axes,
-                opset_version=11)
+        export_onnx(model, input_list, onnx_file_path, input_names,
+                    output_names, do_constant_folding, dynamic_axes)
         if expected_result is None:
-            with torch.no_grad():
-                model_outputs = model(*input_list)
+            model_outputs = model(*input_list)
         else:
             model_outputs = expected_result
         if isinstance(model_outputs, torch.Tensor):
@@ -63,9 +139,7 @@ class TestOnnxRTExporter:
 
         from mmdeploy.backend.onnxruntime import ORTWrapper
         onnx_model = ORTWrapper(onnx_file_path, 'cpu', output_names)
-        with torch.no_grad():
-            onnx_outputs = onnx_model.forward(
-                dict(zip(input_names, input_list)))
+        onnx_outputs = onnx_model.forward(dict(zip(input_names, input_list)))
         onnx_outputs = [onnx_outputs[i] for i in output_names]
         assert_allclose(model_outputs, onnx_outputs, tolerate_small_mismatch)
 
@@ -79,6 +153,45 @@ class TestTensorRTExporter:
     def check_env(self):
         check_backend(Backend.TENSORRT, True)
 
+    @staticmethod
+    def get_engine_cache_key(onnx_model: onnx.ModelProto,
+                             backend_config: dict) -> str:
+        """Get the name of the cached engine built from the onnx model.
+
+        Args:
+            onnx_model (onnx.ModelProto): The onnx model to be converted.
+            backend_config (dict): The TensorRT backend config used to build
+                the engine.
+
+        Returns:
+            str: A sha1 digest identifying the engine.
+        """
+        import tensorrt as trt
+
+        from mmdeploy.backend.tensorrt import get_ops_path
+
+        # the timing cache location does not change the built engine
+        common_config = dict(backend_config.get('common_config', dict()))
+        common_config.pop('timing_cache_file', None)
+        backend_config = dict(backend_config, common_config=common_config)
+
+        sha1 = hashlib.sha1(onnx_model.SerializeToString())
+        sha1.update(repr(backend_config).encode())
+        sha1.update(trt.__version__.encode())
+        # plugin shapes, formats and serialized fields are baked into the
+        # engine, rebuilding the plugin library must invalidate it
+        ops_path = get_ops_path()
+        if os.path.exists(ops_path):
+            stat = os.stat(ops_path)
+            sha1.update(
+                _file_sha1(ops_path, stat.st_mtime_ns,
+                           stat.st_size).encode())
+        # engines are specific to the device they are built on
+        sha1.update(torch.cuda.get_device_name().encode())
+        sha1.update(repr(torch.cuda.get_device_capability()).encode())
+        return sha1.hexdigest()
+
+    @torch.no_grad()
     def run_and_validate(self,
                          model,
                          input_list,
@@ -89,58 +202,82 @@ class TestTensorRTExporter:
                          output_names=None,
                          input_names=None,
                          expected_result=None,
-                         save_dir=None):
+                         save_dir=None,
+                         fp16_mode=False):
         if save_dir is None:
             onnx_file_path = tempfile.NamedTemporaryFile().name
-            trt_file_path = tempfile.NamedTemporaryFile().name
         else:
             onnx_file_path = os.path.join(save_dir, model_name + '.onnx')
-            trt_file_path = os.path.join(save_dir, model_name + '.trt')
         if isinstance(model, onnx.onnx_ml_pb2.ModelProto):
             onnx.save(model, onnx_file_path)
         else:
-            with torch.no_grad():
-                torch.onnx.export(
-                    model,
-                    tuple(input_list),
-                    onnx_file_path,
-                    export_params=True,
-                    keep_initializers_as_inputs=True,
-                    input_names=input_names,
-                    output_names=output_names,
-                    do_constant_folding=do_constant_folding,
-                    dynamic_axes=dynamic_axes,
-                    opset_version=11)
-
-        deploy_cfg = mmcv.Config(
-            dict(
-                backend_config=dict(
-                    type='tensorrt',
-                    common_config=dict(
-                        fp16_mode=False, max_workspace_size=1 << 28),
-                    model_inputs=[
-                        dict(
-                            input_shapes=dict(
-                                zip(input_names, [
-                                    dict(
-                                        min_shape=data.shape,
-                                        opt_shape=data.shape,
-                                        max_shape=data.shape)
-                                    for data in input_list
-                                ])))
-                    ])))
+            export_onnx(model, input_list, onnx_file_path, input_names,
+                        output_names, do_constant_folding, dynamic_axes)
+
+        use_cache = save_dir is None and os.environ.get(TRT_CACHE_ENV,
+                                                        '1') != '0'
+        # from_onnx warns about the timing cache on TensorRT<8, only enable
+        # it where it is supported
+        import tensorrt as trt
+        timing_cache_file = None
+        if use_cache and version.parse(trt.__version__) >= version.parse('8'):
+            timing_cache_file = TRT_TIMING_CACHE
+        backend_config = dict(
+            type='tensorrt',
+            common_config=dict(
+                fp16_mode=fp16_mode,
+                max_workspace_size=1 << 28,
+                timing_cache_file=timing_cache_file),
+            model_inputs=[
+                dict(
+                    input_shapes=dict(
+                        zip(input_names, [
+                            dict(
+                                min_shape=data.shape,
+                                opt_shape=data.shape,
+                                max_shape=data.shape) for data in input_list
+                        ])))
+            ])
+        deploy_cfg = mmcv.Config(dict(backend_config=backend_config))
 
         onnx_model = onnx.load(onnx_file_path)
-        trt_apis.onnx2tensorrt(
-            os.path.dirname(trt_file_path),
-            trt_file_path,
-            0,
-            deploy_cfg=deploy_cfg,
-            onnx_model=onnx_model)
+        tmp_dir = None
+        if use_cache:
+            work_dir = TRT_CACHE_DIR
+            trt_file_name = self.get_engine_cache_key(
+                onnx_model, backend_config) + '.engine'
+        elif save_dir is None:
+            # removed once the engine has been run, at the end of this method
+            tmp_dir = tempfile.TemporaryDirectory()
+            work_dir = tmp_dir.name
+            trt_file_name = model_name + '.engine'
+        else:
+            work_dir = save_dir
+            trt_file_name = model_name + '.engine'
+        trt_file_path = os.path.join(work_dir, trt_file_name)
+        if not use_cache:
+            trt_apis.onnx2tensorrt(
+                work_dir,
+                trt_file_name,
+                0,
+                deploy_cfg=deploy_cfg,
+                onnx_model=onnx_model)
+        elif not os.path.exists(trt_file_path):
+            # build aside and move the engine in place atomically, parallel
+            # workers (e.g. pytest-xdist) never see a partially written file
+            mmcv.mkdir_or_exist(TRT_CACHE_DIR)
+            with tempfile.TemporaryDirectory(dir=TRT_CACHE_DIR) as tmp_dir:
+                trt_apis.onnx2tensorrt(
+                    tmp_dir,
+                    trt_file_name,
+                    0,
+                    deploy_cfg=deploy_cfg,
+                    onnx_model=onnx_model)
+                os.replace(
+                    os.path.join(tmp_dir, trt_file_name), trt_file_path)
         if expected_result is None and not isinstance(
                 model, onnx.onnx_ml_pb2.ModelProto):
-            with torch.no_grad():
-                model_outputs = model(*input_list)
+            model_outputs = model(*input_list)
         else:
             model_outputs = expected_result
         if isinstance(model_outputs, torch.Tensor):
@@ -150,10 +287,28 @@ class TestTensorRTExporter:
 
         from mmdeploy.backend.tensorrt import TRTWrapper
         trt_model = TRTWrapper(trt_file_path, output_names)
-        input_list = [data.cuda() for data in input_list]
-        trt_outputs = trt_model(dict(zip(input_names, input_list)))
-        trt_outputs = [trt_outputs[i].float().cpu() for i in output_names]
-        assert_allclose(model_outputs, trt_outputs, tolerate_small_mismatch)
+        # copy through pinned host memory so that uploading, inference and
+        # downloading are queued on the current stream with a single sync
+        trt_outputs = trt_model(upload_inputs(input_names, input_list))
+        trt_outputs = [trt_outputs[i].float() for i in output_names]
+        host_outputs = [
+            torch.empty(data.shape, pin_memory=True) for data in trt_outputs
+        ]
+        for host_output, trt_output in zip(host_outputs, trt_outputs):
+            host_output.copy_(trt_output, non_blocking=True)
+        torch.cuda.current_stream().synchronize()
+        # half precision kernels can not meet the default fp32 tolerance
+        if fp16_mode:
+            tolerance = dict(rtol=1e-02, atol=1e-02)
+        else:
+            tolerance = dict(rtol=1e-03, atol=1e-05)
+        # check all the outputs at once, the per output comparison is only
+        # needed to report a mismatch
+        if not all_close(model_outputs, host_outputs, **tolerance):
+            assert_allclose(model_outputs, host_outputs,
+                            tolerate_small_mismatch, **tolerance)
+        if tmp_dir is not None:
+            tmp_dir.cleanup()
 
 
 @pytest.mark.skip(reason='This a not test class but a utility class.')
@@ -165,6 +320,7 @@ class TestNCNNExporter:
     def check_env(self):
         check_backend(Backend.NCNN, True)
 
+    @torch.no_grad()
     def run_and_validate(self,
                          model,
                          inputs_list,
@@ -184,26 +340,15 @@ class TestNCNNExporter:
             ncnn_param_path = os.path.join(save_dir, model_name + '.param')
             ncnn_bin_path = os.path.join(save_dir, model_name + '.bin')
 
-        with torch.no_grad():
-            torch.onnx.export(
-                model,
-                tuple(inputs_list),
-                onnx_file_path,
-                export_params=True,
-                keep_initializers_as_inputs=True,
-                input_names=input_names,
-                output_names=output_names,
-                do_constant_folding=do_constant_folding,
-                dynamic_axes=dynamic_axes,
-                opset_version=11)
+        export_onnx(model, inputs_list, onnx_file_path, input_names,
+                    output_names, do_constant_folding, dynamic_axes)
 
         from mmdeploy.backend.ncnn.init_plugins import get_onnx2ncnn_path
         onnx2ncnn_path = get_onnx2ncnn_path()
         subprocess.call(
             [onnx2ncnn_path, onnx_file_path, ncnn_param_path, ncnn_bin_path])
 
-        with torch.no_grad():
-            model_outputs = model(*inputs_list)
+        model_outputs = model(*inputs_list)
         if isinstance(model_outputs, torch.Tensor):
             model_outputs = [model_outputs]
         else: